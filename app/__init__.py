@@ -1,21 +1,50 @@
 """
 Acme Policy Assistant - RAG Application
 """
-from flask import Flask
+from quart import Quart
+from quart.json.provider import DefaultJSONProvider
+import orjson
 import os
 
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson instead of the json module."""
+    
+    OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=self.OPTIONS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand the bytes straight to the response instead of round-tripping a str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.OPTIONS), mimetype=self.mimetype
+        )
+
+
 def create_app():
-    """Create and configure the Flask application."""
-    app = Flask(__name__, 
+    """Create and configure the Quart application."""
+    app = Quart(__name__, 
                 template_folder='templates',
                 static_folder='static')
     
     # Configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
+    # jsonify() and request.get_json() go through orjson
+    app.json = ORJSONProvider(app)
     
     # Register routes
     from app.main import main_bp
     app.register_blueprint(main_bp)
     
+    # Warm the embedding model, index and LLM client before serving so the
+    # first requests neither pay the load time nor race to initialize it
+    if os.environ.get('PRELOAD_RAG_CHAIN', '1') == '1':
+        from app.rag.chain import get_rag_chain
+        get_rag_chain()
+    
     return app
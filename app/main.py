@@ -1,33 +1,45 @@
 """
-Flask Routes and Main Application Logic
+Quart Routes and Main Application Logic
 """
-from flask import Blueprint, render_template, request, jsonify
+from quart import Blueprint, Response, render_template, request, jsonify
+import asyncio
+import gzip
 import time
 
+import orjson
+
 main_bp = Blueprint('main', __name__)
 
+# Health responses may be reused by probes and proxies for this many seconds
+HEALTH_MAX_AGE = 5
 
-# Lazy load RAG chain to avoid loading during imports
-_rag_chain = None
+# The chat page is static once rendered; keep it and its gzip encoding in memory
+_index_page: dict = {}
 
 
 def get_chain():
-    """Get the RAG chain with lazy loading."""
-    global _rag_chain
-    if _rag_chain is None:
-        from app.rag.chain import get_rag_chain
-        _rag_chain = get_rag_chain()
-    return _rag_chain
+    """Get the RAG chain (imported lazily to avoid loading during imports)."""
+    from app.rag.chain import get_rag_chain
+    return get_rag_chain()
 
 
 @main_bp.route('/')
-def index():
+async def index():
     """Render the main chat interface."""
-    return render_template('index.html')
+    if not _index_page:
+        html = (await render_template('index.html')).encode('utf-8')
+        _index_page.update(identity=html, gzip=gzip.compress(html))
+    
+    response = Response(_index_page['identity'], content_type='text/html; charset=utf-8')
+    if request.accept_encodings['gzip']:
+        response.set_data(_index_page['gzip'])
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @main_bp.route('/chat', methods=['POST'])
-def chat():
+async def chat():
     """
     Process a chat message and return the response.
     
@@ -42,7 +54,7 @@ def chat():
         }
     """
     try:
-        data = request.get_json()
+        data = await request.get_json()
         
         if not data or 'message' not in data:
             return jsonify({
@@ -58,34 +70,90 @@ def chat():
         
         # Get response from RAG chain
         chain = get_chain()
-        response = chain.query(question)
+        response = await chain.aquery(question)
         
         return jsonify({
             "answer": response.answer,
             "sources": response.sources,
             "latency_ms": round(response.latency_ms, 2)
         })
-        
+    
     except Exception as e:
         return jsonify({
             "error": f"An error occurred: {str(e)}"
         }), 500
 
 
+def _sse(event: str, payload) -> str:
+    """Format one server-sent event frame."""
+    # Same numpy handling as the app's JSON provider, so scores may be numpy scalars
+    data = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+@main_bp.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    """
+    Process a chat message and stream the answer as server-sent events.
+    
+    Request JSON:
+        {"message": "user question"}
+    
+    Event stream:
+        event: token  data: "partial answer text"    (repeated)
+        event: done   data: {"sources": [...], "latency_ms": 123.4}
+        event: error  data: "error message"          (instead of done)
+    """
+    data = await request.get_json()
+    
+    if not data or 'message' not in data:
+        return jsonify({
+            "error": "Missing 'message' field in request"
+        }), 400
+    
+    question = data['message'].strip()
+    
+    if not question:
+        return jsonify({
+            "error": "Message cannot be empty"
+        }), 400
+    
+    chain = get_chain()
+    
+    async def events():
+        try:
+            async for event, payload in chain.astream(question):
+                if event == "done":
+                    payload = {**payload, "latency_ms": round(payload["latency_ms"], 2)}
+                yield _sse(event, payload)
+        except Exception as e:
+            yield _sse("error", f"An error occurred: {str(e)}")
+    
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop Nginx from buffering the stream until the answer is complete
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.timeout = None
+    return response
+
+
 @main_bp.route('/health')
-def health():
+async def health():
     """Health check endpoint."""
     try:
         # Basic health check
         chain = get_chain()
         doc_count = chain.vectorstore.count
         
-        return jsonify({
+        response = jsonify({
             "status": "healthy",
             "documents_indexed": doc_count,
             "model": chain.model_name,
+            "query_embedding_cache": chain.vectorstore.embedding_model.query_cache_info(),
             "timestamp": time.time()
         })
+        response.cache_control.max_age = HEALTH_MAX_AGE
+        return response
     except Exception as e:
         return jsonify({
             "status": "unhealthy",
@@ -94,11 +162,17 @@ def health():
 
 
 @main_bp.route('/api/reindex', methods=['POST'])
-def reindex():
+async def reindex():
     """Force reindex of all documents."""
     try:
-        from app.rag.vectorstore import initialize_vectorstore
-        store = initialize_vectorstore(force_reindex=True)
+        # Reindex the store the chain is serving from, in place
+        chain = get_chain()
+        store = chain.vectorstore
+        # Re-embedding is CPU-bound; keep the event loop serving other requests
+        await asyncio.to_thread(store.reindex)
+        
+        # Cached answers may cite chunks that no longer exist
+        chain.clear_caches()
         
         return jsonify({
             "status": "success",
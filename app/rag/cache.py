@@ -0,0 +1,223 @@
+"""
+Cache Module
+
+Semantic response cache that lets near-duplicate questions skip retrieval
+and the LLM call entirely, and an on-disk embedding cache that lets
+reindexing skip chunks whose content has not changed.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+import numpy as np
+
+from app.rag.locking import data_lock
+
+
+class SemanticCache:
+    """
+    LRU cache of answers keyed by question embedding.
+    
+    Cached question embeddings are L2-normalized and held in a faiss
+    inner-product index, so a lookup is a single cosine-similarity search.
+    A hit is any cached question whose similarity meets ``threshold``.
+    """
+    
+    def __init__(self, dimension: int, threshold: float = None, max_size: int = None):
+        try:
+            import faiss
+        except ImportError:
+            raise ImportError("faiss is required. Install with: pip install faiss-cpu")
+        
+        self._faiss = faiss
+        self.dimension = dimension
+        self.threshold = threshold if threshold is not None else float(
+            os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.92'))
+        self.max_size = max_size if max_size is not None else int(
+            os.environ.get('SEMANTIC_CACHE_SIZE', '1024'))
+        
+        # IDMap lets us evict by id without renumbering the remaining vectors
+        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(dimension))
+        # id -> (answer, sources), ordered from least to most recently used
+        self._entries: "OrderedDict[int, Tuple[str, List[Dict[str, Any]]]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+    
+    def _normalize(self, embedding: np.ndarray) -> np.ndarray:
+        """Return the embedding as a normalized (1, d) float32 array."""
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        self._faiss.normalize_L2(vector)
+        return vector
+    
+    def lookup(self, embedding: np.ndarray) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Find a cached answer for a semantically similar question.
+        
+        Args:
+            embedding: Query embedding vector
+        
+        Returns:
+            (answer, sources) tuple on a hit, otherwise None
+        """
+        vector = self._normalize(embedding)
+        
+        with self._lock:
+            if self.index.ntotal == 0:
+                return None
+            
+            scores, ids = self.index.search(vector, 1)
+            entry_id = int(ids[0, 0])
+            if entry_id < 0 or scores[0, 0] < self.threshold:
+                return None
+            
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id]
+    
+    def add(self, embedding: np.ndarray, answer: str, sources: List[Dict[str, Any]]):
+        """
+        Store an answer for a question embedding, evicting the LRU entry if full.
+        
+        Args:
+            embedding: Query embedding vector
+            answer: Generated answer text
+            sources: Source list returned alongside the answer
+        """
+        if self.max_size <= 0:
+            return
+        
+        vector = self._normalize(embedding)
+        
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            
+            self.index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (answer, sources)
+            
+            while len(self._entries) > self.max_size:
+                evicted_id, _ = self._entries.popitem(last=False)
+                self.index.remove_ids(np.array([evicted_id], dtype=np.int64))
+    
+    def clear(self):
+        """Drop all cached answers."""
+        with self._lock:
+            self.index.reset()
+            self._entries.clear()
+    
+    @property
+    def size(self) -> int:
+        """Return the number of cached answers."""
+        return len(self._entries)
+
+
+class EmbeddingCache:
+    """
+    Persistent map of chunk content hash -> embedding.
+    
+    Stored as a single .npz holding the hashes, a (n, d) float32 matrix whose
+    rows line up with them, and the model name the vectors came from.
+    """
+    
+    FILENAME = "embeddings_cache.npz"
+    
+    def __init__(self, path: str, model_name: str, dimension: int):
+        self.path = path
+        self.model_name = model_name
+        self.dimension = dimension
+        self._rows: Dict[str, int] = {}
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._load()
+    
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """Return a stable hash of a chunk's text."""
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def _load(self):
+        """Load cached vectors, ignoring caches written by a different model."""
+        if not os.path.exists(self.path):
+            return
+        
+        try:
+            with data_lock(os.path.dirname(self.path)), np.load(self.path) as data:
+                if str(data['model_name']) != self.model_name or data['vectors'].shape[1] != self.dimension:
+                    return
+                self._vectors = np.ascontiguousarray(data['vectors'], dtype=np.float32)
+                self._rows = {h: i for i, h in enumerate(data['hashes'].tolist())}
+        except Exception as e:
+            print(f"Warning: Could not load embedding cache {self.path}: {e}")
+    
+    def _save(self):
+        """
+        Write the cache atomically so a crash never leaves a torn file.
+        
+        Each save stages into its own temp file under the data directory
+        lock, so concurrent processes never rename each other's partial writes.
+        """
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        hashes = sorted(self._rows, key=self._rows.get)
+        with data_lock(directory):
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + ".",
+                                            suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, hashes=np.array(hashes, dtype=str), vectors=self._vectors,
+                             model_name=np.array(self.model_name))
+                os.replace(tmp_path, self.path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], np.ndarray],
+              prune: bool = False) -> np.ndarray:
+        """
+        Embed texts, only calling embed_fn for content not seen before.
+        
+        Args:
+            texts: Texts to embed
+            embed_fn: Function embedding a list of texts into a (n, d) array
+            prune: texts is the whole corpus, so drop every cached vector
+                not among them (keeps the cache from growing across edits)
+        
+        Returns:
+            float32 array of shape (len(texts), dimension)
+        """
+        hashes = [self.content_hash(text) for text in texts]
+        
+        # First occurrence of each uncached hash, in order
+        missing: Dict[str, int] = {}
+        for i, h in enumerate(hashes):
+            if h not in self._rows and h not in missing:
+                missing[h] = i
+        
+        changed = bool(missing)
+        if missing:
+            new_vectors = embed_fn([texts[i] for i in missing.values()])
+            start = len(self._vectors)
+            self._vectors = np.vstack([self._vectors, new_vectors]).astype(np.float32, copy=False)
+            for offset, h in enumerate(missing):
+                self._rows[h] = start + offset
+        
+        print(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        
+        # Fancy indexing returns a fresh array the caller may normalize in place
+        rows = np.fromiter((self._rows[h] for h in hashes), dtype=np.int64, count=len(hashes))
+        vectors = self._vectors[rows]
+        
+        if prune:
+            keep = dict.fromkeys(hashes)
+            if len(keep) < len(self._rows):
+                print(f"Embedding cache: pruned {len(self._rows) - len(keep)} stale entries")
+                self._vectors = np.ascontiguousarray(
+                    self._vectors[[self._rows[h] for h in keep]], dtype=np.float32)
+                self._rows = {h: i for i, h in enumerate(keep)}
+                changed = True
+        
+        if changed:
+            self._save()
+        
+        return vectors
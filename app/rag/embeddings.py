@@ -2,29 +2,183 @@
 Embeddings Module
 
 Handles the embedding model for converting text to vectors.
-Uses sentence-transformers (local, free) by default.
+Uses an int8-quantized ONNX export of the model on ONNX Runtime when one is
+available (see export_onnx_model), falling back to sentence-transformers.
 """
 import os
 os.environ.setdefault('TORCH_DEVICE_BACKEND_AUTOLOAD', '0')
 os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+from functools import lru_cache
+from pathlib import Path
 from typing import List
 import numpy as np
 
 
+# Default location of the exported ONNX model, relative to project root
+DEFAULT_ONNX_DIR = Path(__file__).parent.parent.parent / "onnx_model"
+
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    # Serial on purpose: parallel=True can land on numba's workqueue threading
+    # layer, which aborts the process when called from two threads at once
+    # (e.g. a reindex worker thread embedding while a request embeds a query).
+    @njit(fastmath=True, cache=True)
+    def _pool_and_norm(hidden, attention_mask, out):
+        """Fused masked mean + L2 norm, one pass over each row of hidden."""
+        batch, seq_len, dim = hidden.shape
+        for b in range(batch):
+            row = out[b]
+            row[:] = 0.0
+            count = 0.0
+            for t in range(seq_len):
+                if attention_mask[b, t]:
+                    count += 1.0
+                    for j in range(dim):
+                        row[j] += hidden[b, t, j]
+            
+            scale = 1.0 / max(count, 1e-9)
+            norm = 0.0
+            for j in range(dim):
+                row[j] *= scale
+                norm += row[j] * row[j]
+            
+            scale = 1.0 / max(np.sqrt(norm), 1e-12)
+            for j in range(dim):
+                row[j] *= scale
+
+
+def _mean_pool_normalize(hidden: np.ndarray, attention_mask: np.ndarray,
+                         out: np.ndarray = None) -> np.ndarray:
+    """Masked mean over tokens followed by L2 normalization, written into out."""
+    if out is None:
+        out = np.empty((hidden.shape[0], hidden.shape[2]), dtype=np.float32)
+    
+    if njit is not None:
+        _pool_and_norm(np.ascontiguousarray(hidden, dtype=np.float32), attention_mask, out)
+        return out
+    
+    mask = attention_mask[..., None].astype(np.float32)
+    pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return np.divide(pooled, np.clip(norms, 1e-12, None), out=out)
+
+
 class EmbeddingModel:
     """Wrapper for embedding models."""
     
-    def __init__(self, model_name: str = None):
+    # Large batches keep the GPU busy during bulk ingestion
+    BATCH_SIZE = 128
+    # Matches the sentence-transformers max_seq_length for MiniLM
+    MAX_SEQ_LENGTH = 256
+    # Exact-string query cache; long texts bypass it to bound memory
+    QUERY_CACHE_SIZE = 4096
+    QUERY_CACHE_MAX_CHARS = 512
+    
+    def __init__(self, model_name: str = None, onnx_dir: str = None):
         self.model_name = model_name or os.environ.get('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+        self.onnx_dir = Path(onnx_dir or os.environ.get('ONNX_MODEL_DIR', DEFAULT_ONNX_DIR))
         self.model = None
+        self.session = None
+        self.tokenizer = None
+        self._onnx_inputs = set()
+        self.device = None
+        self.backend = None
+        self._dimension = None
         self._load_model()
+        self._embed_query_cached = lru_cache(maxsize=self.QUERY_CACHE_SIZE)(self._embed_query_uncached)
+    
+    def _detect_device(self) -> str:
+        """Pick the fastest available device (EMBEDDING_DEVICE overrides)."""
+        device = os.environ.get('EMBEDDING_DEVICE')
+        if device:
+            return device
+        
+        try:
+            import torch
+        except ImportError:
+            return 'cpu'
+        
+        if torch.cuda.is_available():
+            return 'cuda'
+        if getattr(torch.backends, 'mps', None) and torch.backends.mps.is_available():
+            return 'mps'
+        return 'cpu'
+    
+    def _onnx_model_path(self) -> Path:
+        """Return the exported ONNX model, preferring the int8-quantized file."""
+        quantized = self.onnx_dir / "model_quantized.onnx"
+        return quantized if quantized.exists() else self.onnx_dir / "model.onnx"
     
     def _load_model(self):
-        """Load the embedding model."""
+        """Load the embedding model on the best available backend."""
+        backend = os.environ.get('EMBEDDING_BACKEND', 'auto')
+        if backend == 'onnx':
+            # Runs on CPU regardless; skip importing torch (~1.3s and hundreds
+            # of MB per worker) just to look for a GPU
+            self._load_onnx_model()
+            return
+        
+        self.device = self._detect_device()
+        
+        # ONNX Runtime int8 is the fastest CPU path; GPUs stay on torch FP16
+        use_onnx = backend == 'auto' and self.device == 'cpu' and self._onnx_model_path().exists()
+        if use_onnx:
+            self._load_onnx_model()
+        else:
+            self._load_sentence_transformer()
+    
+    def _load_onnx_model(self):
+        """Load the exported model into an ONNX Runtime CPU session."""
+        model_path = self._onnx_model_path()
+        if not model_path.exists():
+            raise RuntimeError(
+                f"ONNX model not found in {self.onnx_dir}. "
+                "Export it with: python -m app.rag.embeddings --export-onnx"
+            )
+        
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError(
+                "onnxruntime and tokenizers are required. Install with: pip install onnxruntime tokenizers"
+            )
+        
+        try:
+            print(f"Loading embedding model: {self.model_name} (ONNX Runtime: {model_path.name})")
+            self.tokenizer = Tokenizer.from_file(str(self.onnx_dir / "tokenizer.json"))
+            self.tokenizer.enable_truncation(max_length=self.MAX_SEQ_LENGTH)
+            self.tokenizer.enable_padding()
+            
+            self.session = ort.InferenceSession(str(model_path), providers=["CPUExecutionProvider"])
+            self._onnx_inputs = {i.name for i in self.session.get_inputs()}
+            self.device = 'cpu'
+            self.backend = 'onnx-int8' if model_path.name == "model_quantized.onnx" else 'onnx'
+            
+            # The probe also triggers the pooling kernel's JIT compile up front
+            self._dimension = int(self._encode(["dimension probe"], 1).shape[1])
+            print("Embedding model loaded successfully!")
+        except Exception as e:
+            raise RuntimeError(f"Failed to load embedding model: {e}")
+    
+    def _load_sentence_transformer(self):
+        """Load the model with sentence-transformers (PyTorch)."""
         try:
             from sentence_transformers import SentenceTransformer
-            print(f"Loading embedding model: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
+            print(f"Loading embedding model: {self.model_name} (device: {self.device})")
+            self.model = SentenceTransformer(self.model_name, device=self.device)
+            
+            # FP16 halves memory traffic on CUDA with negligible retrieval impact
+            if self.device == 'cuda':
+                self.model.half()
+            self.backend = 'sentence-transformers'
+            self._dimension = self.model.get_sentence_embedding_dimension()
             print("Embedding model loaded successfully!")
         except ImportError:
             raise ImportError(
@@ -33,7 +187,39 @@ class EmbeddingModel:
         except Exception as e:
             raise RuntimeError(f"Failed to load embedding model: {e}")
     
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Encode texts into normalized float32 embeddings on the loaded backend."""
+        if self.session is None:
+            embeddings = self.model.encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=len(texts) > 10
+            )
+            # FP16 models return float16; faiss expects contiguous float32
+            return np.ascontiguousarray(embeddings, dtype=np.float32)
+        
+        # Each batch is pooled straight into its rows of the output matrix
+        embeddings = None
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": attention_mask,
+            }
+            if "token_type_ids" in self._onnx_inputs:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+            
+            hidden = self.session.run(None, feeds)[0]
+            if embeddings is None:
+                embeddings = np.empty((len(texts), hidden.shape[-1]), dtype=np.float32)
+            _mean_pool_normalize(hidden, attention_mask, embeddings[start:start + len(encodings)])
+        
+        return embeddings
+    
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
         """
         Embed a list of documents.
         
@@ -41,46 +227,108 @@ class EmbeddingModel:
             texts: List of text strings to embed
         
         Returns:
-            List of embedding vectors
+            float32 array of shape (len(texts), dimension)
         """
         if not texts:
-            return []
+            return np.empty((0, self.dimension), dtype=np.float32)
         
-        embeddings = self.model.encode(texts, show_progress_bar=len(texts) > 10)
-        return embeddings.tolist()
+        return self._encode(texts, self.BATCH_SIZE)
     
-    def embed_query(self, text: str) -> List[float]:
+    def _embed_query_uncached(self, text: str) -> np.ndarray:
+        """Embed a query, returning a read-only vector safe to share from the cache."""
+        embedding = self._encode([text], 1)[0]
+        embedding.setflags(write=False)
+        return embedding
+    
+    def embed_query(self, text: str) -> np.ndarray:
         """
         Embed a single query text.
         
+        Verbatim repeats are served from an in-memory LRU cache.
+        
         Args:
             text: Query string to embed
         
         Returns:
-            Embedding vector
+            1-D read-only float32 embedding vector
         """
-        embedding = self.model.encode([text])[0]
-        return embedding.tolist()
+        if len(text) > self.QUERY_CACHE_MAX_CHARS:
+            return self._embed_query_uncached(text)
+        return self._embed_query_cached(text)
+    
+    def query_cache_info(self) -> dict:
+        """Return hit/miss counters for the query embedding cache."""
+        info = self._embed_query_cached.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize
+        }
     
     @property
     def dimension(self) -> int:
         """Return the embedding dimension."""
-        return self.model.get_sentence_embedding_dimension()
+        return self._dimension
 
 
 # Singleton instance for efficiency
-_embedding_model = None
-
-
+@lru_cache(maxsize=1)
 def get_embedding_model() -> EmbeddingModel:
     """Get or create the singleton embedding model instance."""
-    global _embedding_model
-    if _embedding_model is None:
-        _embedding_model = EmbeddingModel()
-    return _embedding_model
+    return EmbeddingModel()
+
+
+def export_onnx_model(model_name: str = None, output_dir: str = None) -> Path:
+    """
+    Export the embedding model to ONNX and quantize it to int8.
+    
+    Requires optimum: pip install "optimum[onnxruntime]"
+    
+    Args:
+        model_name: sentence-transformers model to export
+        output_dir: Directory for model.onnx, model_quantized.onnx and tokenizer files
+    
+    Returns:
+        Path of the quantized model
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        from transformers import AutoTokenizer
+    except ImportError:
+        raise ImportError(
+            'optimum is required for export. Install with: pip install "optimum[onnxruntime]"'
+        )
+    
+    model_name = model_name or os.environ.get('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+    if '/' not in model_name:
+        model_name = f"sentence-transformers/{model_name}"
+    output_dir = Path(output_dir or os.environ.get('ONNX_MODEL_DIR', DEFAULT_ONNX_DIR))
+    
+    print(f"Exporting {model_name} to {output_dir}")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    
+    # Dynamic quantization: int8 weights, activations quantized at runtime
+    quantized_path = output_dir / "model_quantized.onnx"
+    quantize_dynamic(str(output_dir / "model.onnx"), str(quantized_path), weight_type=QuantType.QInt8)
+    print(f"Quantized model written to {quantized_path}")
+    return quantized_path
 
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Embedding model utilities")
+    parser.add_argument("--export-onnx", action="store_true", help="Export and int8-quantize the model for ONNX Runtime")
+    args = parser.parse_args()
+    
+    if args.export_onnx:
+        export_onnx_model()
+        raise SystemExit(0)
+    
     # Test embeddings
     model = get_embedding_model()
     
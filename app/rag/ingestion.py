@@ -4,8 +4,9 @@ Document Ingestion Module
 Handles loading, parsing, and chunking of policy documents.
 """
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 
 class Document:
@@ -19,6 +20,8 @@ class Document:
 class DocumentLoader:
     """Loads documents from the policies directory."""
     
+    MAX_WORKERS = 8
+    
     def __init__(self, policies_dir: str = None):
         if policies_dir is None:
             # Default to policies directory relative to project root
@@ -28,35 +31,41 @@ class DocumentLoader:
     
     def load_documents(self) -> List[Document]:
         """Load all markdown files from the policies directory."""
-        documents = []
-        
         if not self.policies_dir.exists():
             print(f"Warning: Policies directory not found: {self.policies_dir}")
-            return documents
+            return []
         
-        for file_path in self.policies_dir.glob("*.md"):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                # Extract title from first heading or filename
-                title = self._extract_title(content, file_path.stem)
-                
-                doc = Document(
-                    content=content,
-                    metadata={
-                        "source": file_path.name,
-                        "title": title,
-                        "file_path": str(file_path)
-                    }
-                )
-                documents.append(doc)
-                print(f"Loaded: {file_path.name}")
-                
-            except Exception as e:
-                print(f"Error loading {file_path}: {e}")
+        paths = list(self.policies_dir.glob("*.md"))
+        
+        # File reads release the GIL, so overlap them; map() preserves order
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            results = list(executor.map(self._read_one, paths))
         
-        return documents
+        return [doc for doc in results if doc is not None]
+    
+    def _read_one(self, file_path: Path) -> Optional[Document]:
+        """Read a single markdown file into a Document."""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            
+            # Extract title from first heading or filename
+            title = self._extract_title(content, file_path.stem)
+            
+            doc = Document(
+                content=content,
+                metadata={
+                    "source": file_path.name,
+                    "title": title,
+                    "file_path": str(file_path)
+                }
+            )
+            print(f"Loaded: {file_path.name}")
+            return doc
+            
+        except Exception as e:
+            print(f"Error loading {file_path}: {e}")
+            return None
     
     def _extract_title(self, content: str, fallback: str) -> str:
         """Extract title from the first markdown heading."""
@@ -70,6 +79,9 @@ class DocumentLoader:
 class TextChunker:
     """Chunks documents into smaller pieces for embedding."""
     
+    # Length of the source preview shown alongside answers
+    SNIPPET_LENGTH = 200
+    
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
@@ -87,13 +99,20 @@ class TextChunker:
                     metadata={
                         **doc.metadata,
                         "chunk_id": i,
-                        "chunk_total": len(doc_chunks)
+                        "chunk_total": len(doc_chunks),
+                        "snippet": self._snippet(chunk_text)
                     }
                 )
                 chunks.append(chunk)
         
         return chunks
     
+    def _snippet(self, text: str) -> str:
+        """Return the truncated preview of a chunk used in source listings."""
+        if len(text) > self.SNIPPET_LENGTH:
+            return text[:self.SNIPPET_LENGTH] + "..."
+        return text
+    
     def _split_text(self, text: str) -> List[str]:
         """Split text into chunks with overlap."""
         chunks = []
@@ -101,31 +120,37 @@ class TextChunker:
         # Split by paragraphs first (double newline)
         paragraphs = text.split('\n\n')
         
-        current_chunk = ""
+        # Buffer paragraphs and track the joined length instead of growing a string
+        parts: List[str] = []
+        cur_len = 0
         
         for para in paragraphs:
             para = para.strip()
             if not para:
                 continue
+            para_len = len(para)
             
             # If adding this paragraph exceeds chunk size
-            if len(current_chunk) + len(para) + 2 > self.chunk_size:
-                if current_chunk:
+            if cur_len + para_len + 2 > self.chunk_size:
+                if parts:
+                    current_chunk = "\n\n".join(parts)
                     chunks.append(current_chunk.strip())
                     # Keep overlap from end of current chunk
-                    overlap_text = current_chunk[-self.chunk_overlap:] if len(current_chunk) > self.chunk_overlap else current_chunk
-                    current_chunk = overlap_text + "\n\n" + para
+                    overlap_text = current_chunk[-self.chunk_overlap:] if cur_len > self.chunk_overlap else current_chunk
+                    parts = [overlap_text, para]
+                    cur_len = len(overlap_text) + 2 + para_len
                 else:
                     # Paragraph itself is too long, split by sentences/lines
                     para_chunks = self._split_large_paragraph(para)
                     chunks.extend(para_chunks[:-1])
-                    current_chunk = para_chunks[-1] if para_chunks else ""
+                    tail = para_chunks[-1] if para_chunks else ""
+                    parts = [tail] if tail else []
+                    cur_len = len(tail)
             else:
-                if current_chunk:
-                    current_chunk += "\n\n" + para
-                else:
-                    current_chunk = para
+                cur_len = cur_len + 2 + para_len if parts else para_len
+                parts.append(para)
         
+        current_chunk = "\n\n".join(parts)
         if current_chunk.strip():
             chunks.append(current_chunk.strip())
         
@@ -135,18 +160,26 @@ class TextChunker:
         """Split a large paragraph by lines or sentences."""
         lines = para.split('\n')
         chunks = []
-        current = ""
+        # Same buffering as _split_text: cur_len is the length of the lines joined by "\n"
+        parts: List[str] = []
+        cur_len = 0
         
         for line in lines:
-            if len(current) + len(line) + 1 > self.chunk_size:
-                if current:
-                    chunks.append(current.strip())
-                current = line
+            line_len = len(line)
+            if cur_len + line_len + 1 > self.chunk_size:
+                if cur_len:
+                    chunks.append("\n".join(parts).strip())
+                parts = [line]
+                cur_len = line_len
+            elif cur_len:
+                parts.append(line)
+                cur_len += 1 + line_len
             else:
-                current = current + "\n" + line if current else line
+                parts = [line]
+                cur_len = line_len
         
-        if current:
-            chunks.append(current.strip())
+        if cur_len:
+            chunks.append("\n".join(parts).strip())
         
         return chunks if chunks else [para]
 
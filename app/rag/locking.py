@@ -0,0 +1,61 @@
+"""
+Locking Module
+
+Advisory lock on the data directory, shared by every process (e.g. each
+Hypercorn worker) that reads or writes the persisted index and caches, so
+no process renames files into place while another is writing or loading.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: threads of this process are still serialized
+    fcntl = None
+
+
+LOCK_FILENAME = ".lock"
+
+_registry_lock = threading.Lock()
+_thread_locks: Dict[str, threading.RLock] = {}
+_depths: Dict[str, int] = {}
+_fds: Dict[str, int] = {}
+
+
+@contextmanager
+def data_lock(directory: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on ``directory/.lock`` for the duration of the block.
+    
+    flock() is per open file, so a second flock() from this process would
+    block on its own lock; instead one descriptor per directory is held
+    while a per-directory RLock makes the lock reentrant within a thread
+    and serializes the other threads of this process.
+    
+    Args:
+        directory: Data directory whose files the caller reads or writes
+    """
+    path = os.path.join(os.path.abspath(directory), LOCK_FILENAME)
+    with _registry_lock:
+        thread_lock = _thread_locks.setdefault(path, threading.RLock())
+    
+    with thread_lock:
+        depth = _depths.get(path, 0)
+        if depth == 0 and fcntl is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            _fds[path] = fd
+        _depths[path] = depth + 1
+        
+        try:
+            yield
+        finally:
+            _depths[path] -= 1
+            if _depths[path] == 0 and path in _fds:
+                fd = _fds.pop(path)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
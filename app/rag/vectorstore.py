@@ -1,45 +1,200 @@
 """
 Vector Store Module
 
-Handles storage and retrieval of document embeddings using ChromaDB.
+Handles storage and retrieval of document embeddings using a faiss index.
 """
 import os
-os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
-os.environ.setdefault('CHROMA_TELEMETRY', 'False')
+import pickle
+import tempfile
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-import chromadb
-from chromadb.config import Settings
+from typing import List, Dict, Any, Optional, Tuple
+import faiss
+import numpy as np
 
+from app.rag.cache import EmbeddingCache
 from app.rag.embeddings import get_embedding_model
 from app.rag.ingestion import Document, ingest_documents
+from app.rag.locking import data_lock
 
 
 class VectorStore:
-    """ChromaDB-based vector store for document retrieval."""
+    """faiss-based vector store for document retrieval."""
     
-    COLLECTION_NAME = "policy_documents"
+    INDEX_FILENAME = "faiss.index"
+    DOCSTORE_FILENAME = "docstore.pkl"
     
     def __init__(self, persist_directory: str = None):
         if persist_directory is None:
             persist_directory = str(Path(__file__).parent.parent.parent / "data")
         
         self.persist_directory = persist_directory
+        self.index_path = os.path.join(persist_directory, self.INDEX_FILENAME)
+        self.docstore_path = os.path.join(persist_directory, self.DOCSTORE_FILENAME)
         self.embedding_model = get_embedding_model()
-        
-        # Initialize ChromaDB with persistence
-        self.client = chromadb.PersistentClient(
-            path=persist_directory,
-            settings=Settings(anonymized_telemetry=False)
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(persist_directory, EmbeddingCache.FILENAME),
+            # Backends produce slightly different vectors, so key by both
+            f"{self.embedding_model.model_name}:{self.embedding_model.backend}",
+            self.embedding_model.dimension
         )
         
-        # Get or create collection with cosine distance
-        self.collection = self.client.get_or_create_collection(
-            name=self.COLLECTION_NAME,
-            metadata={"description": "Acme Corporation Policy Documents", "hnsw:space": "cosine"}
-        )
+        # Inner product over L2-normalized vectors == cosine similarity.
+        # Documents and metadata live in parallel lists indexed by faiss row id.
+        # Writers never mutate these in place: they build replacements and
+        # publish them together via _swap(), so searches always see one
+        # consistent generation even while a reindex runs in another thread.
+        self.index = faiss.IndexFlatIP(self.embedding_model.dimension)
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        # Normalized mean of all chunk vectors, used for cheap topicality checks
+        self.centroid: Optional[np.ndarray] = None
+        # Guards publishing/snapshotting the fields above
+        self._lock = threading.Lock()
+        # Serializes writers (and the embedding cache they share)
+        self._write_lock = threading.Lock()
+        # Bumped on every swap, so dependents (e.g. the chain's caches) can tell
+        # when the served index changed
+        self.generation = 0
+        # Identity of the docstore file last loaded or written by this process
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        
+        self.reload()
+        
+        print(f"Vector store initialized. Documents in index: {self.count}")
+    
+    def reload(self):
+        """Publish the persisted index and docstore, e.g. after another process rebuilt them."""
+        # Other processes may be mid-persist; the lock keeps the pair consistent
+        with data_lock(self.persist_directory):
+            stamp = self._disk_stamp()
+            loaded = self._load()
+            if loaded is not None:
+                self._swap(*loaded)
+            self._stamp = stamp
+    
+    def refresh(self) -> int:
+        """
+        Reload if another process persisted a newer index since this one loaded.
+        
+        Each worker process holds its own copy of the index, so a reindex
+        served by one worker reaches the others through the files on disk.
+        The check is a single stat() of the docstore, which is always
+        replaced last.
+        
+        Returns:
+            The generation now being served
+        """
+        if self._disk_stamp() != self._stamp:
+            self.reload()
+        return self.generation
+    
+    def _disk_stamp(self) -> Optional[Tuple[int, int, int]]:
+        """Return (inode, mtime, size) of the persisted docstore, or None if absent."""
+        try:
+            st = os.stat(self.docstore_path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+    
+    def _load(self) -> Optional[Tuple[faiss.Index, List[str], List[str], List[Dict[str, Any]]]]:
+        """
+        Read a persisted index and docstore if both exist.
+        
+        Returns:
+            (index, ids, documents, metadatas) tuple, or None if nothing usable is on disk
+        """
+        if not (os.path.exists(self.index_path) and os.path.exists(self.docstore_path)):
+            return None
+        
+        index = self._read_index()
+        if index.d != self.embedding_model.dimension:
+            print(f"Warning: Persisted index dimension {index.d} does not match "
+                  f"embedding model ({self.embedding_model.dimension}). Ignoring it.")
+            return None
         
-        print(f"Vector store initialized. Documents in collection: {self.collection.count()}")
+        with open(self.docstore_path, 'rb') as f:
+            ids, documents, metadatas = pickle.load(f)
+        return index, ids, documents, metadatas
+    
+    def _read_index(self):
+        """
+        Read the persisted index, memory-mapping its vectors when faiss supports it.
+        
+        A mapped flat index searches straight out of the page cache, so cold
+        start does not copy the vectors and workers share the same pages.
+        
+        A mapped index is read-only; writers always build a new index from
+        its vectors (see _copy_index) rather than adding to it.
+        """
+        mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+        if mmap_flag is not None:
+            try:
+                return faiss.read_index(self.index_path, mmap_flag)
+            except RuntimeError as e:
+                print(f"Warning: Could not mmap {self.index_path}, reading it into memory: {e}")
+        return faiss.read_index(self.index_path)
+    
+    def _copy_index(self) -> faiss.IndexFlatIP:
+        """Return a new in-memory index holding the current vectors."""
+        index = faiss.IndexFlatIP(self.embedding_model.dimension)
+        if self.index.ntotal:
+            index.add(self.index.reconstruct_n(0, self.index.ntotal))
+        return index
+    
+    @staticmethod
+    def _compute_centroid(index: faiss.Index) -> Optional[np.ndarray]:
+        """Return the normalized centroid of every vector in index."""
+        if index.ntotal == 0:
+            return None
+        
+        centroid = index.reconstruct_n(0, index.ntotal).mean(axis=0, keepdims=True)
+        faiss.normalize_L2(centroid)
+        return centroid[0]
+    
+    def _swap(self, index: faiss.Index, ids: List[str], documents: List[str],
+              metadatas: List[Dict[str, Any]]):
+        """Publish a fully built index and docstore in one step."""
+        centroid = self._compute_centroid(index)
+        with self._lock:
+            self.index, self.ids, self.documents, self.metadatas, self.centroid = (
+                index, ids, documents, metadatas, centroid)
+            self.generation += 1
+    
+    def _temp_path(self, target: str) -> str:
+        """Return a fresh temp file beside target, unique to this writer."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.persist_directory,
+                                        prefix=os.path.basename(target) + ".", suffix=".tmp")
+        os.close(fd)
+        return tmp_path
+    
+    def _persist(self):
+        """
+        Write the index and docstore to disk.
+        
+        Files are written to unique temp files beside their targets and
+        renamed into place, so processes that have the old index mapped keep
+        reading a complete file. The data directory lock is held across both
+        renames so no process loads a new index with the old docstore.
+        """
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with data_lock(self.persist_directory):
+            index_tmp = self._temp_path(self.index_path)
+            docstore_tmp = self._temp_path(self.docstore_path)
+            try:
+                faiss.write_index(self.index, index_tmp)
+                with open(docstore_tmp, 'wb') as f:
+                    pickle.dump((self.ids, self.documents, self.metadatas), f)
+                os.replace(index_tmp, self.index_path)
+                os.replace(docstore_tmp, self.docstore_path)
+                # Our own write is already being served; don't reload it
+                self._stamp = self._disk_stamp()
+            finally:
+                for tmp_path in (index_tmp, docstore_tmp):
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
     
     def add_documents(self, documents: List[Document]) -> int:
         """
@@ -54,36 +209,54 @@ class VectorStore:
         if not documents:
             return 0
         
-        # Prepare data for ChromaDB
-        texts = [doc.page_content for doc in documents]
-        embeddings = self.embedding_model.embed_documents(texts)
-        
-        # Create unique IDs
-        ids = [f"doc_{i}_{doc.metadata.get('source', 'unknown')}_{doc.metadata.get('chunk_id', 0)}" 
-               for i, doc in enumerate(documents)]
-        
-        # Prepare metadata (ChromaDB requires simple types)
-        metadatas = []
-        for doc in documents:
-            metadata = {
-                "source": str(doc.metadata.get("source", "")),
-                "title": str(doc.metadata.get("title", "")),
-                "chunk_id": int(doc.metadata.get("chunk_id", 0)),
-                "chunk_total": int(doc.metadata.get("chunk_total", 1))
-            }
-            metadatas.append(metadata)
-        
-        # Add to collection
-        self.collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            documents=texts,
-            metadatas=metadatas
-        )
+        with self._write_lock, data_lock(self.persist_directory):
+            # Grow the latest persisted index, not a copy another worker replaced
+            self.refresh()
+            texts, embeddings, ids, metadatas = self._prepare(documents)
+            
+            # Build the grown index beside the live one, then swap it in
+            index = self._copy_index()
+            index.add(embeddings)
+            self._swap(index, self.ids + ids, self.documents + texts, self.metadatas + metadatas)
+            self._persist()
         
         print(f"Added {len(documents)} documents to vector store")
         return len(documents)
     
+    def _prepare(self, documents: List[Document],
+                 prune: bool = False) -> Tuple[List[str], np.ndarray, List[str], List[Dict[str, Any]]]:
+        """
+        Embed documents and build their ids and metadata.
+        
+        Args:
+            documents: Chunks to embed
+            prune: documents is the full corpus; drop other cached embeddings
+        
+        Returns:
+            (texts, normalized embeddings, ids, metadatas)
+        """
+        texts = [doc.page_content for doc in documents]
+        # Unchanged chunks reuse their cached vectors instead of being re-embedded
+        embeddings = self.embedding_cache.embed(texts, self.embedding_model.embed_documents, prune=prune)
+        faiss.normalize_L2(embeddings)
+        
+        # Keep metadata to simple types so the docstore stays portable,
+        # reading each document's metadata dict once
+        metadatas = [
+            {
+                "source": str(meta.get("source", "")),
+                "title": str(meta.get("title", "")),
+                "chunk_id": int(meta.get("chunk_id", 0)),
+                "chunk_total": int(meta.get("chunk_total", 1)),
+                "snippet": str(meta.get("snippet", ""))
+            }
+            for meta in (doc.metadata for doc in documents)
+        ]
+        # source + chunk number is unique within an ingest
+        ids = [f"{m['source'] or 'unknown'}:{m['chunk_id']}" for m in metadatas]
+        
+        return texts, embeddings, ids, metadatas
+    
     def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
         """
         Search for similar documents.
@@ -96,41 +269,84 @@ class VectorStore:
             List of results with content, metadata, and similarity score
         """
         query_embedding = self.embedding_model.embed_query(query)
+        return self.search_by_embedding(query_embedding, k=k)
+    
+    def search_by_embedding(self, query_embedding: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Search for similar documents using a precomputed query embedding.
         
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k,
-            include=["documents", "metadatas", "distances"]
-        )
+        Args:
+            query_embedding: Embedding vector of the query
+            k: Number of results to return
         
-        # Format results
+        Returns:
+            List of results with content, metadata, and similarity score
+        """
+        # Published generations are never mutated, so search a snapshot unlocked
+        with self._lock:
+            index, ids, documents, metadatas = self.index, self.ids, self.documents, self.metadatas
+        
+        if index.ntotal == 0:
+            return []
+        
+        # Copy so normalizing in place never touches the caller's vector
+        query = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(query)
+        
+        scores, indices = index.search(query, min(k, index.ntotal))
+        
+        # Format results (faiss pads missing neighbours with -1)
         formatted_results = []
         
-        if results and results['documents'] and results['documents'][0]:
-            for i in range(len(results['documents'][0])):
-                result = {
-                    "content": results['documents'][0][i],
-                    "metadata": results['metadatas'][0][i] if results['metadatas'] else {},
-                    "distance": results['distances'][0][i] if results['distances'] else 0,
-                    "score": 1 - (results['distances'][0][i] if results['distances'] else 0)  # Convert distance to similarity
-                }
-                formatted_results.append(result)
+        for score, idx in zip(scores[0], indices[0]):
+            if idx < 0:
+                continue
+            result = {
+                "id": ids[idx],
+                "content": documents[idx],
+                "metadata": metadatas[idx],
+                "distance": 1 - float(score),
+                "score": float(score)
+            }
+            formatted_results.append(result)
         
         return formatted_results
     
     def clear(self):
-        """Clear all documents from the collection."""
-        self.client.delete_collection(self.COLLECTION_NAME)
-        self.collection = self.client.create_collection(
-            name=self.COLLECTION_NAME,
-            metadata={"description": "Acme Corporation Policy Documents", "hnsw:space": "cosine"}
-        )
+        """Clear all documents from the index."""
+        with self._write_lock, data_lock(self.persist_directory):
+            self._swap(faiss.IndexFlatIP(self.embedding_model.dimension), [], [], [])
+            self._persist()
         print("Vector store cleared")
     
+    def reindex(self):
+        """
+        Re-index all policy documents.
+        
+        The new index is built off to the side and swapped in at the end, so
+        searches running meanwhile keep using the previous one, never an
+        empty or half-built store. The data directory lock is held throughout,
+        so reindexes from several processes run one after another.
+        """
+        with self._write_lock, data_lock(self.persist_directory):
+            # Load and chunk documents
+            chunks = ingest_documents()
+            
+            # The chunks are the whole corpus, so the embedding cache can
+            # forget content that no longer exists
+            texts, embeddings, ids, metadatas = self._prepare(chunks, prune=True)
+            index = faiss.IndexFlatIP(self.embedding_model.dimension)
+            if len(texts):
+                index.add(embeddings)
+            self._swap(index, ids, texts, metadatas)
+            self._persist()
+        
+        print(f"Reindexed {len(chunks)} documents into vector store")
+    
     @property
     def count(self) -> int:
         """Return the number of documents in the store."""
-        return self.collection.count()
+        return self.index.ntotal
 
 
 def initialize_vectorstore(force_reindex: bool = False) -> VectorStore:
@@ -145,36 +361,28 @@ def initialize_vectorstore(force_reindex: bool = False) -> VectorStore:
     """
     store = VectorStore()
     
-    # Check if we need to index
-    if force_reindex or store.count == 0:
-        print("Indexing documents...")
-        
-        if force_reindex:
-            store.clear()
+    # Workers starting together on an empty data directory must not all
+    # build the index: the first one builds it, the rest pick up its result
+    with data_lock(store.persist_directory):
+        if not force_reindex and store.count == 0:
+            store.reload()
         
-        # Load and chunk documents
-        chunks = ingest_documents()
-        
-        # Add to vector store
-        store.add_documents(chunks)
-        
-        print(f"Indexing complete. Total documents: {store.count}")
-    else:
-        print(f"Using existing index with {store.count} documents")
+        # Check if we need to index
+        if force_reindex or store.count == 0:
+            print("Indexing documents...")
+            store.reindex()
+            print(f"Indexing complete. Total documents: {store.count}")
+        else:
+            print(f"Using existing index with {store.count} documents")
     
     return store
 
 
 # Singleton instance
-_vectorstore = None
-
-
+@lru_cache(maxsize=1)
 def get_vectorstore() -> VectorStore:
     """Get or create the singleton vector store instance."""
-    global _vectorstore
-    if _vectorstore is None:
-        _vectorstore = initialize_vectorstore()
-    return _vectorstore
+    return initialize_vectorstore()
 
 
 if __name__ == "__main__":
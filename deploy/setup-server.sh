@@ -49,6 +49,12 @@ sudo -u "$APP_USER" bash -c "
     pip install --upgrade pip -q
     pip install -r requirements.txt -q
     echo '✅ Dependencies installed'
+    pip install 'optimum[onnxruntime]' -q && python -m app.rag.embeddings --export-onnx \
+        && echo '✅ ONNX embedding model exported' \
+        || echo '⚠️  ONNX export failed, falling back to sentence-transformers'
+    # Build the index once now, so the workers start on a ready data/ directory
+    python -c 'from app.rag.vectorstore import initialize_vectorstore; initialize_vectorstore()' \
+        && echo '✅ Vector index built'
 "
 
 # ── 5. Create .env file (user must fill in GROQ_API_KEY) ──
@@ -67,6 +73,17 @@ else
     echo ".env already exists, skipping"
 fi
 
+# Serve from the exported ONNX model without loading torch in every worker
+if ls "$APP_DIR"/onnx_model/model*.onnx &>/dev/null; then
+    if grep -q '^EMBEDDING_BACKEND=' "$ENV_FILE"; then
+        sed -i 's/^EMBEDDING_BACKEND=.*/EMBEDDING_BACKEND=onnx/' "$ENV_FILE"
+    else
+        echo "EMBEDDING_BACKEND=onnx" >> "$ENV_FILE"
+    fi
+    chown "$APP_USER:$APP_USER" "$ENV_FILE"
+    echo "✅ Embedding backend set to ONNX Runtime"
+fi
+
 # ── 6. Create systemd service ──
 echo "[6/7] Creating systemd service..."
 cat > /etc/systemd/system/policy-assistant.service << EOF
@@ -80,7 +97,7 @@ User=$APP_USER
 WorkingDirectory=$APP_DIR
 Environment=PATH=$APP_DIR/venv/bin:/usr/bin
 EnvironmentFile=$APP_DIR/.env
-ExecStart=$APP_DIR/venv/bin/gunicorn run:app --bind 0.0.0.0:$PORT --timeout 120 --workers 2
+ExecStart=$APP_DIR/venv/bin/hypercorn run:app --bind 0.0.0.0:$PORT --workers 2
 Restart=always
 RestartSec=5
 
@@ -99,6 +116,13 @@ server {
     listen 80;
     server_name $SERVER_IP;
 
+    # The app pre-compresses the chat page; this covers JSON and static assets.
+    # text/event-stream is left out so streamed tokens are never held back.
+    gzip on;
+    gzip_proxied any;
+    gzip_min_length 1024;
+    gzip_types application/json text/css application/javascript;
+
     location / {
         proxy_pass http://127.0.0.1:$PORT;
         proxy_set_header Host \$host;
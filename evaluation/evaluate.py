@@ -14,16 +14,26 @@ Required – System Metrics:
 Optional – Ablations:
   - Compare retrieval k values (k=3, k=5, k=8)
   - Compare chunk sizes (500, 1000, 1500 chars)
+
+Calibration:
+  - Similarity of on- vs off-topic questions to the corpus centroid,
+    used to choose TOPIC_SIMILARITY_THRESHOLD
 """
 import json
 import time
 import os
 import sys
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
-from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Tuple
+from dataclasses import asdict, dataclass, field, fields
+from functools import lru_cache
 import numpy as np
+import orjson
+import pandas as pd
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -31,6 +41,39 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from dotenv import load_dotenv
 load_dotenv()
 
+__all__ = [
+    "EvaluationResult",
+    "ExpectedAnswer",
+    "load_questions",
+    "evaluate_groundedness",
+    "evaluate_citation",
+    "evaluate_off_topic",
+    "evaluate_partial_match",
+    "run_evaluation",
+    "run_ablation_k",
+    "run_topic_calibration",
+    "save_results",
+]
+
+# Questions are evaluated concurrently; each one mostly waits on the LLM API
+MAX_WORKERS = 10
+
+# Keeps each question's progress lines together when running in parallel
+_print_lock = threading.Lock()
+
+# Scoring patterns, compiled once
+_TOK_RE = re.compile(r'[a-z0-9]+')
+_NUM_RE = re.compile(r'\$?[\d,]+(?:/\w+)?')
+_NON_WORD_RE = re.compile(r'[^\w]')
+
+# Phrases that show an off-topic question was refused, matched in one pass
+OFF_TOPIC_INDICATORS = [
+    "can only answer", "company policies", "outside",
+    "don't have", "not in our policies",
+    "hr@acmecorp.com", "contact hr",
+]
+_OFF_TOPIC_RE = re.compile('|'.join(map(re.escape, OFF_TOPIC_INDICATORS)))
+
 
 # ────────────────────────────────────────────────────────────
 # Data classes
@@ -52,51 +95,90 @@ class EvaluationResult:
     partial_match_score: float = 0.0  # 0-1 token overlap ratio
 
 
+@dataclass(frozen=True)
+class ExpectedAnswer:
+    """Gold answer pre-split into the term sets the scorers compare against."""
+    tokens: frozenset              # _tokenize() output, for partial match
+    numbers: Tuple[str, ...]       # numbers/amounts, for groundedness pass 1
+    key_terms: Tuple[str, ...]     # punctuation-stripped words > 3 chars, pass 2
+    fallback_terms: Tuple[str, ...]  # used when there are no key terms
+
+    @classmethod
+    def from_text(cls, expected: str) -> "ExpectedAnswer":
+        """Split a gold answer once so scoring each response reuses the sets."""
+        if not expected or expected == "OFF_TOPIC":
+            return cls(frozenset(), (), (), ())
+        expected_lower = expected.lower()
+        words = expected_lower.split()
+        key_terms = [_NON_WORD_RE.sub('', t) for t in words]
+        return cls(
+            tokens=frozenset(_tokenize(expected_lower)),
+            numbers=tuple(n.strip('()') for n in _NUM_RE.findall(expected_lower)),
+            key_terms=tuple(t for t in key_terms if len(t) > 3),
+            fallback_terms=tuple(_NON_WORD_RE.sub('', t) for t in words if len(t) > 1),
+        )
+
+
+# EvaluationResult fields reported per question in the structured output
+PER_QUESTION_COLUMNS = [
+    'question_id', 'question', 'category', 'expected_answer', 'actual_answer',
+    'sources_cited', 'is_grounded', 'citation_correct', 'partial_match_score', 'latency_ms',
+]
+
+
 # ────────────────────────────────────────────────────────────
 # Helpers
 # ────────────────────────────────────────────────────────────
+@lru_cache(maxsize=4)
+def _read_questions(filepath: str) -> Tuple[Dict, ...]:
+    """Parse a questions file once; callers get copies via load_questions()."""
+    with open(filepath, 'r') as f:
+        data = json.load(f)
+    questions = data['questions']
+    for q in questions:
+        q['_expected'] = ExpectedAnswer.from_text(q['expected_answer'])
+        q['_source_lower'] = (q.get('source') or '').lower()  # off-topic questions have none
+    return tuple(questions)
+
+
 def load_questions(filepath: str = None) -> List[Dict]:
-    """Load evaluation questions from JSON file."""
+    """Load evaluation questions with their pre-split ExpectedAnswer and lowercased source."""
     if filepath is None:
         filepath = Path(__file__).parent / "questions.json"
-    with open(filepath, 'r') as f:
-        data = json.load(f)
-    return data['questions']
+    # Shallow copies keep the cached originals safe from callers' edits;
+    # the ExpectedAnswer values are frozen and can be shared
+    return [dict(q) for q in _read_questions(str(filepath))]
 
 
-def _tokenize(text: str) -> set:
-    """Lowercase tokenize, strip punctuation, drop short words."""
-    tokens = re.findall(r'[a-z0-9]+', text.lower())
-    return {t for t in tokens if len(t) > 2}
+def _tokenize(text_lower: str) -> set:
+    """Tokenize already-lowercased text, strip punctuation, drop short words."""
+    return {t for t in _TOK_RE.findall(text_lower) if len(t) > 2}
 
 
-def evaluate_groundedness(answer: str, expected_keywords: str) -> bool:
+def evaluate_groundedness(answer_lower: str, expected: ExpectedAnswer) -> bool:
     """
-    Check if the answer contains expected information.
+    Check if the (already lowercased) answer contains expected information.
     Uses two-pass matching:
       1. Extract numbers/amounts (e.g. $90, 15, 250) and check they appear in answer.
       2. Keyword overlap on remaining terms – grounded if >= 30% match.
     Grounded = True if EITHER the number check passes OR the keyword check passes.
     """
-    if not answer or not expected_keywords:
+    if not answer_lower:
         return False
-    answer_lower = answer.lower()
-    expected_lower = expected_keywords.lower()
 
-    # Pass 1: Extract all numbers and dollar amounts from expected answer
-    numbers = re.findall(r'\$?[\d,]+(?:/\w+)?', expected_lower)
+    # Pass 1: Numbers and dollar amounts from the expected answer
+    numbers = expected.numbers
     if numbers:
-        num_matches = sum(1 for n in numbers if n.strip('()') in answer_lower)
+        num_matches = sum(1 for n in numbers if n in answer_lower)
         # If the primary number (first) appears, or at least 40% of numbers match
-        if num_matches >= 1 and (num_matches >= len(numbers) * 0.4 or numbers[0].strip('()') in answer_lower):
+        if num_matches >= 1 and (num_matches >= len(numbers) * 0.4 or numbers[0] in answer_lower):
             return True
 
-    # Pass 2: Keyword overlap (strip punctuation from terms)
-    key_terms = [re.sub(r'[^\w]', '', t) for t in expected_lower.split()]
-    key_terms = [t for t in key_terms if len(t) > 3]
+    # Pass 2: Keyword overlap (terms already stripped of punctuation)
+    key_terms = expected.key_terms
     if not key_terms:
         # Fallback: if no long keywords, check if any expected words appear
-        all_terms = [re.sub(r'[^\w]', '', t) for t in expected_lower.split() if len(t) > 1]
+        all_terms = expected.fallback_terms
         if all_terms:
             matches = sum(1 for t in all_terms if t in answer_lower)
             return matches >= len(all_terms) * 0.3
@@ -105,48 +187,134 @@ def evaluate_groundedness(answer: str, expected_keywords: str) -> bool:
     return matches >= len(key_terms) * 0.3
 
 
-def evaluate_citation(sources_cited: List[str], expected_source: str) -> bool:
-    """Check if the correct source document was cited."""
-    if not expected_source:
+def evaluate_citation(sources_cited_lower: List[str], expected_source_lower: str) -> bool:
+    """Check if the correct source document was cited (all names already lowercased)."""
+    if not expected_source_lower:
         return True
-    expected_lower = expected_source.lower()
-    for source in sources_cited:
-        if expected_lower in source.lower() or source.lower() in expected_lower:
-            return True
-    return False
+    return any(expected_source_lower in s or s in expected_source_lower for s in sources_cited_lower)
 
 
-def evaluate_off_topic(answer: str) -> bool:
-    """Check if off-topic questions are properly refused."""
-    indicators = [
-        "can only answer", "company policies", "outside",
-        "don't have", "not in our policies",
-        "hr@acmecorp.com", "contact hr",
-    ]
-    answer_lower = answer.lower()
-    return any(ind in answer_lower for ind in indicators)
+def evaluate_off_topic(answer_lower: str) -> bool:
+    """Check if off-topic questions are properly refused (answer already lowercased)."""
+    return _OFF_TOPIC_RE.search(answer_lower) is not None
 
 
-def evaluate_partial_match(answer: str, expected: str) -> float:
+def evaluate_partial_match(answer_tokens: set, expected_tokens: frozenset) -> float:
     """
     Token-level partial match score (Jaccard-like).
-    Returns a float 0-1 representing overlap between answer and gold answer.
+    Returns a float 0-1 representing overlap between the answer's and the
+    gold answer's _tokenize() sets.
     """
-    if not answer or not expected or expected == "OFF_TOPIC":
-        return 0.0
-    ans_tokens = _tokenize(answer)
-    exp_tokens = _tokenize(expected)
-    if not exp_tokens:
+    if not expected_tokens:
         return 0.0
-    overlap = ans_tokens & exp_tokens
+    overlap = answer_tokens & expected_tokens
     # Use recall-oriented: how many expected tokens appear in the answer
-    return len(overlap) / len(exp_tokens)
+    return len(overlap) / len(expected_tokens)
 
 
 # ────────────────────────────────────────────────────────────
 # Main evaluation
 # ────────────────────────────────────────────────────────────
-def run_evaluation(verbose: bool = True) -> Dict[str, Any]:
+def _progress_header(q: Dict, index: int, total: int) -> str:
+    """Format the progress line printed for a question in verbose mode."""
+    return f"[{index+1:2d}/{total}] {q['category']:15s} | {q['question'][:55]}..."
+
+
+def _eval_one(chain, q: Dict, index: int, total: int, verbose: bool) -> Optional[EvaluationResult]:
+    """Query and score a single question; returns None if the query failed."""
+
+    try:
+        response = chain.query(q['question'], query_embedding=q.get('_embedding'))
+        sources_cited = [s['source'] for s in response.sources]
+        # Lowercased once; every scorer below works on this copy
+        answer_lower = response.answer.lower()
+
+        is_off_topic = q['expected_answer'] == "OFF_TOPIC"
+        latency_ms = response.latency_ms + q.get('_embed_ms', 0.0)
+
+        if is_off_topic:
+            is_grounded = True
+            citation_correct = True
+            off_topic_handled = evaluate_off_topic(answer_lower)
+            partial_score = 0.0
+        else:
+            is_grounded = evaluate_groundedness(answer_lower, q['_expected'])
+            citation_correct = evaluate_citation([s.lower() for s in sources_cited], q['_source_lower'])
+            off_topic_handled = True
+            partial_score = evaluate_partial_match(_tokenize(answer_lower), q['_expected'].tokens)
+
+        result = EvaluationResult(
+            question_id=q['id'],
+            question=q['question'],
+            category=q['category'],
+            expected_answer=q['expected_answer'],
+            actual_answer=response.answer,
+            sources_cited=sources_cited,
+            expected_source=q.get('source', ''),
+            latency_ms=latency_ms,
+            is_grounded=is_grounded,
+            citation_correct=citation_correct,
+            is_off_topic_handled=off_topic_handled,
+            partial_match_score=partial_score,
+        )
+
+        if verbose:
+            icon = "✅" if (is_grounded and citation_correct) else "❌"
+            extra = f", Match: {partial_score:.0%}" if not is_off_topic else ", Off-topic ✓" if off_topic_handled else ", Off-topic ✗"
+            with _print_lock:
+                print(_progress_header(q, index, total))
+                print(f"       {icon} Grounded: {is_grounded}, Citation: {citation_correct}{extra}, {latency_ms:.0f}ms")
+
+        return result
+
+    except Exception as e:
+        with _print_lock:
+            if verbose:
+                print(_progress_header(q, index, total))
+            print(f"       ❌ Error: {e}")
+        return None
+
+
+def _embed_questions(chain, questions: List[Dict]) -> float:
+    """
+    Embed every question in one batch and attach it as q['_embedding'].
+
+    The chain's own latency no longer covers embedding a pre-embedded query,
+    so each question also gets its amortized share of the batch as
+    q['_embed_ms'], which the scorers add back to keep latency end-to-end.
+
+    Returns:
+        Amortized embedding time per question in milliseconds
+    """
+    start = time.perf_counter_ns()
+    embeddings = chain.vectorstore.embedding_model.embed_documents([q['question'] for q in questions])
+    embed_ms = (time.perf_counter_ns() - start) / 1e6 / max(len(questions), 1)
+    for q, embedding in zip(questions, embeddings):
+        q['_embedding'] = embedding
+        q['_embed_ms'] = embed_ms
+    return embed_ms
+
+
+@contextmanager
+def _semantic_cache_disabled(chain):
+    """
+    Empty the chain's semantic cache and stop it caching while inside.
+
+    Without this, concurrent workers answer near-duplicate questions from
+    whichever one finished first, so scores and latencies depend on thread
+    timing and measure the cache rather than retrieval + generation.
+    """
+    cache = chain.semantic_cache
+    max_size = cache.max_size
+    chain.clear_caches()
+    cache.max_size = 0
+    try:
+        yield
+    finally:
+        cache.max_size = max_size
+
+
+def run_evaluation(verbose: bool = True, max_workers: int = MAX_WORKERS) -> Dict[str, Any]:
     """Run the full evaluation suite and return structured results."""
     from app.rag.chain import get_rag_chain
 
@@ -163,115 +331,100 @@ def run_evaluation(verbose: bool = True) -> Dict[str, Any]:
     print(f"  Documents:  {chain.vectorstore.count}")
     print(f"  Retrieval k: {chain.k}")
 
-    results: List[EvaluationResult] = []
-    latencies: List[float] = []
+    embed_ms = _embed_questions(chain, questions)
 
     print("\n─── Running evaluations ───\n")
 
-    for i, q in enumerate(questions):
-        if verbose:
-            print(f"[{i+1:2d}/{len(questions)}] {q['category']:15s} | {q['question'][:55]}...")
-
-        try:
-            response = chain.query(q['question'])
-            latencies.append(response.latency_ms)
-            sources_cited = [s['source'] for s in response.sources]
-
-            is_off_topic = q['expected_answer'] == "OFF_TOPIC"
-
-            if is_off_topic:
-                is_grounded = True
-                citation_correct = True
-                off_topic_handled = evaluate_off_topic(response.answer)
-                partial_score = 0.0
-            else:
-                is_grounded = evaluate_groundedness(response.answer, q['expected_answer'])
-                citation_correct = evaluate_citation(sources_cited, q.get('source', ''))
-                off_topic_handled = True
-                partial_score = evaluate_partial_match(response.answer, q['expected_answer'])
-
-            result = EvaluationResult(
-                question_id=q['id'],
-                question=q['question'],
-                category=q['category'],
-                expected_answer=q['expected_answer'],
-                actual_answer=response.answer,
-                sources_cited=sources_cited,
-                expected_source=q.get('source', ''),
-                latency_ms=response.latency_ms,
-                is_grounded=is_grounded,
-                citation_correct=citation_correct,
-                is_off_topic_handled=off_topic_handled,
-                partial_match_score=partial_score,
-            )
-            results.append(result)
-
-            if verbose:
-                icon = "✅" if (is_grounded and citation_correct) else "❌"
-                extra = f", Match: {partial_score:.0%}" if not is_off_topic else ", Off-topic ✓" if off_topic_handled else ", Off-topic ✗"
-                print(f"       {icon} Grounded: {is_grounded}, Citation: {citation_correct}{extra}, {response.latency_ms:.0f}ms")
-
-        except Exception as e:
-            print(f"       ❌ Error: {e}")
-            continue
+    workers = max(1, min(max_workers, len(questions)))
+    with _semantic_cache_disabled(chain), ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() yields in question order, so the report order is unchanged
+        evaluated = executor.map(
+            lambda item: _eval_one(chain, item[1], item[0], len(questions), verbose),
+            enumerate(questions),
+        )
+        results: List[EvaluationResult] = [r for r in evaluated if r is not None]
 
     # ── Compute metrics ──
-    on_topic  = [r for r in results if r.expected_answer != "OFF_TOPIC"]
-    off_topic = [r for r in results if r.expected_answer == "OFF_TOPIC"]
-
-    groundedness_pct = (sum(1 for r in on_topic if r.is_grounded) / len(on_topic) * 100) if on_topic else 0
-    citation_pct     = (sum(1 for r in on_topic if r.citation_correct) / len(on_topic) * 100) if on_topic else 0
-    off_topic_pct    = (sum(1 for r in off_topic if r.is_off_topic_handled) / len(off_topic) * 100) if off_topic else 100
+    # One frame over all results; every aggregate below is a column operation
+    df = pd.DataFrame([asdict(r) for r in results], columns=[f.name for f in fields(EvaluationResult)])
+    # Partition with one comparison over the column, reused for both halves
+    off_mask = (df['expected_answer'] == "OFF_TOPIC").to_numpy()
+    on_df = df[~off_mask]
+    off_df = df[off_mask]
+    has_on = not on_df.empty
+
+    groundedness_pct = on_df['is_grounded'].mean() * 100 if has_on else 0
+    citation_pct     = on_df['citation_correct'].mean() * 100 if has_on else 0
+    off_topic_pct    = off_df['is_off_topic_handled'].mean() * 100 if not off_df.empty else 100
 
     # Partial / Exact match
-    partial_scores = [r.partial_match_score for r in on_topic]
-    avg_partial_match = np.mean(partial_scores) * 100 if partial_scores else 0
-    exact_match_pct   = (sum(1 for s in partial_scores if s >= 0.8) / len(partial_scores) * 100) if partial_scores else 0
+    avg_partial_match = on_df['partial_match_score'].mean() * 100 if has_on else 0
+    exact_match_pct   = (on_df['partial_match_score'] >= 0.8).mean() * 100 if has_on else 0
 
     # Latency – computed over on-topic queries only (as required: 10-20 queries)
-    on_topic_latencies = [r.latency_ms for r in on_topic]
-    latency_p50 = np.percentile(on_topic_latencies, 50) if on_topic_latencies else 0
-    latency_p95 = np.percentile(on_topic_latencies, 95) if on_topic_latencies else 0
-    latency_avg = np.mean(on_topic_latencies) if on_topic_latencies else 0
-    latency_min = np.min(on_topic_latencies) if on_topic_latencies else 0
-    latency_max = np.max(on_topic_latencies) if on_topic_latencies else 0
-
-    pass_rate = (sum(1 for r in on_topic if r.is_grounded and r.citation_correct) / len(on_topic) * 100) if on_topic else 0
+    # Both percentiles from a single partition of one array
+    on_topic_latencies = on_df['latency_ms'].to_numpy()
+    if has_on:
+        latency_p50, latency_p95 = np.percentile(on_topic_latencies, [50, 95])
+        latency_avg = on_topic_latencies.mean()
+        latency_min = on_topic_latencies.min()
+        latency_max = on_topic_latencies.max()
+    else:
+        latency_p50 = latency_p95 = latency_avg = latency_min = latency_max = 0
+
+    pass_rate = (on_df['is_grounded'] & on_df['citation_correct']).mean() * 100 if has_on else 0
+
+    # Per-category aggregates in a single groupby (sorted by category)
+    cat_stats = on_df.groupby('category').agg(
+        total=('question_id', 'count'),
+        grounded=('is_grounded', 'sum'),
+        citation_correct=('citation_correct', 'sum'),
+        avg_partial_match=('partial_match_score', 'mean'),
+    )
+    cat_stats['avg_partial_match'] *= 100
 
     # ── Print report ──
-    print("\n" + "=" * 70)
-    print("  EVALUATION RESULTS")
-    print("=" * 70)
-
-    print(f"\n📊 Answer Quality Metrics (on {len(on_topic)} on-topic questions):")
-    print(f"   Groundedness:        {groundedness_pct:.1f}%")
-    print(f"   Citation Accuracy:   {citation_pct:.1f}%")
-    print(f"   Partial Match (avg): {avg_partial_match:.1f}%")
-    print(f"   Exact Match (≥80%):  {exact_match_pct:.1f}%")
-    print(f"   Off-topic Handling:  {off_topic_pct:.1f}% (on {len(off_topic)} off-topic questions)")
-
-    print(f"\n⚡ Latency Metrics (over {len(on_topic_latencies)} on-topic queries):")
-    print(f"   Min:     {latency_min:.0f}ms")
-    print(f"   Average: {latency_avg:.0f}ms")
-    print(f"   P50:     {latency_p50:.0f}ms")
-    print(f"   P95:     {latency_p95:.0f}ms")
-    print(f"   Max:     {latency_max:.0f}ms")
-
-    print(f"\n📈 Overall Summary:")
-    print(f"   Total questions:     {len(questions)}")
-    print(f"   Successful queries:  {len(results)}")
-    print(f"   Overall pass rate:   {pass_rate:.1f}%")
-
-    print(f"\n📂 Category Breakdown:")
-    categories = sorted(set(r.category for r in on_topic))
-    for cat in categories:
-        cr = [r for r in on_topic if r.category == cat]
-        g = sum(1 for r in cr if r.is_grounded)
-        c = sum(1 for r in cr if r.citation_correct)
-        pm = np.mean([r.partial_match_score for r in cr]) * 100
-        print(f"   {cat:18s}  Grounded: {g}/{len(cr)}  Citation: {c}/{len(cr)}  Match: {pm:.0f}%")
+    # Built up line by line and written once rather than print() per line
+    lines: List[str] = []
+    lines.append("\n" + "=" * 70)
+    lines.append("  EVALUATION RESULTS")
+    lines.append("=" * 70)
+
+    lines.append(f"\n📊 Answer Quality Metrics (on {len(on_df)} on-topic questions):")
+    lines.append(f"   Groundedness:        {groundedness_pct:.1f}%")
+    lines.append(f"   Citation Accuracy:   {citation_pct:.1f}%")
+    lines.append(f"   Partial Match (avg): {avg_partial_match:.1f}%")
+    lines.append(f"   Exact Match (≥80%):  {exact_match_pct:.1f}%")
+    lines.append(f"   Off-topic Handling:  {off_topic_pct:.1f}% (on {len(off_df)} off-topic questions)")
+
+    lines.append(f"\n⚡ Latency Metrics (over {len(on_df)} on-topic queries):")
+    lines.append(f"   Min:     {latency_min:.0f}ms")
+    lines.append(f"   Average: {latency_avg:.0f}ms")
+    lines.append(f"   P50:     {latency_p50:.0f}ms")
+    lines.append(f"   P95:     {latency_p95:.0f}ms")
+    lines.append(f"   Max:     {latency_max:.0f}ms")
+    lines.append(f"   (end-to-end, incl. {embed_ms:.1f}ms/query amortized batch embedding)")
+
+    lines.append(f"\n📈 Overall Summary:")
+    lines.append(f"   Total questions:     {len(questions)}")
+    lines.append(f"   Successful queries:  {len(results)}")
+    lines.append(f"   Overall pass rate:   {pass_rate:.1f}%")
+
+    lines.append(f"\n📂 Category Breakdown:")
+    for cat in cat_stats.itertuples():
+        lines.append(f"   {cat.Index:18s}  Grounded: {cat.grounded}/{cat.total}  Citation: {cat.citation_correct}/{cat.total}  Match: {cat.avg_partial_match:.0f}%")
+
+    sys.stdout.write("\n".join(lines) + "\n")
 
     # ── Structured output ──
+    # Per-question records straight from the frame, rounded column-wise
+    per_question = (
+        df[PER_QUESTION_COLUMNS]
+        .round({'partial_match_score': 3, 'latency_ms': 1})
+        .rename(columns={'question_id': 'id'})
+        .to_dict(orient='records')
+    )
+
     output = {
         "metrics": {
             "answer_quality": {
@@ -282,12 +435,13 @@ def run_evaluation(verbose: bool = True) -> Dict[str, Any]:
                 "off_topic_handling_pct": round(off_topic_pct, 1),
             },
             "latency": {
-                "num_queries": len(on_topic_latencies),
+                "num_queries": len(on_df),
                 "min_ms": round(latency_min, 1),
                 "avg_ms": round(latency_avg, 1),
                 "p50_ms": round(latency_p50, 1),
                 "p95_ms": round(latency_p95, 1),
                 "max_ms": round(latency_max, 1),
+                "embed_ms_per_query": round(embed_ms, 1),
             },
             "summary": {
                 "total_questions": len(questions),
@@ -295,30 +449,8 @@ def run_evaluation(verbose: bool = True) -> Dict[str, Any]:
                 "pass_rate_pct": round(pass_rate, 1),
             },
         },
-        "per_question": [
-            {
-                "id": r.question_id,
-                "question": r.question,
-                "category": r.category,
-                "expected_answer": r.expected_answer,
-                "actual_answer": r.actual_answer,
-                "sources_cited": r.sources_cited,
-                "is_grounded": r.is_grounded,
-                "citation_correct": r.citation_correct,
-                "partial_match_score": round(r.partial_match_score, 3),
-                "latency_ms": round(r.latency_ms, 1),
-            }
-            for r in results
-        ],
-        "category_breakdown": {
-            cat: {
-                "total": len([r for r in on_topic if r.category == cat]),
-                "grounded": sum(1 for r in on_topic if r.category == cat and r.is_grounded),
-                "citation_correct": sum(1 for r in on_topic if r.category == cat and r.citation_correct),
-                "avg_partial_match": round(np.mean([r.partial_match_score for r in on_topic if r.category == cat]) * 100, 1),
-            }
-            for cat in categories
-        },
+        "per_question": per_question,
+        "category_breakdown": cat_stats.round({'avg_partial_match': 1}).to_dict(orient='index'),
     }
 
     return output
@@ -327,12 +459,32 @@ def run_evaluation(verbose: bool = True) -> Dict[str, Any]:
 # ────────────────────────────────────────────────────────────
 # Ablation study
 # ────────────────────────────────────────────────────────────
-def run_ablation_k(verbose: bool = True) -> Dict[str, Any]:
+def _ablation_one(chain, q: Dict, verbose: bool) -> Optional[Tuple[float, bool, bool, float]]:
+    """Query and score one ablation question; returns (latency, grounded, cited, match)."""
+    try:
+        resp = chain.query(q['question'], query_embedding=q.get('_embedding'))
+        sources = [s['source'] for s in resp.sources]
+        answer_lower = resp.answer.lower()
+        g = evaluate_groundedness(answer_lower, q['_expected'])
+        c = evaluate_citation([s.lower() for s in sources], q['_source_lower'])
+        p = evaluate_partial_match(_tokenize(answer_lower), q['_expected'].tokens)
+        latency_ms = resp.latency_ms + q.get('_embed_ms', 0.0)
+        if verbose:
+            with _print_lock:
+                print(f"   [{q['id']:2d}] G:{g} C:{c} M:{p:.0%} {latency_ms:.0f}ms")
+        return latency_ms, g, c, p
+    except Exception as e:
+        with _print_lock:
+            print(f"   [{q['id']:2d}] Error: {e}")
+        return None
+
+
+def run_ablation_k(verbose: bool = True, max_workers: int = MAX_WORKERS) -> Dict[str, Any]:
     """
     Ablation: compare different retrieval k values (k=3, k=5, k=8).
     Uses a subset of 10 on-topic questions for efficiency.
     """
-    from app.rag.chain import RAGChain
+    from app.rag.chain import get_rag_chain
 
     print("\n" + "=" * 70)
     print("  ABLATION STUDY: Retrieval k")
@@ -342,48 +494,120 @@ def run_ablation_k(verbose: bool = True) -> Dict[str, Any]:
     k_values = [3, 5, 8]
     ablation_results = {}
 
+    # One warm chain serves every sweep; only its retrieval depth changes,
+    # and the questions are embedded once for all of them
+    chain = get_rag_chain()
+    original_k = chain.k
+    embed_ms = _embed_questions(chain, questions)
+    embedder = chain.vectorstore.embedding_model
+    cache_before = embedder.query_cache_info()
+    answered = 0
+
     for k in k_values:
-        print(f"\n── Testing k={k} on {len(questions)} questions ──")
-        chain = RAGChain(k=k)
-        grounded = 0
-        cited = 0
-        latencies = []
-        partial_scores = []
-
-        for q in questions:
-            try:
-                resp = chain.query(q['question'])
-                latencies.append(resp.latency_ms)
-                sources = [s['source'] for s in resp.sources]
-                g = evaluate_groundedness(resp.answer, q['expected_answer'])
-                c = evaluate_citation(sources, q.get('source', ''))
-                p = evaluate_partial_match(resp.answer, q['expected_answer'])
-                if g: grounded += 1
-                if c: cited += 1
-                partial_scores.append(p)
-                if verbose:
-                    print(f"   [{q['id']:2d}] G:{g} C:{c} M:{p:.0%} {resp.latency_ms:.0f}ms")
-            except Exception as e:
-                print(f"   [{q['id']:2d}] Error: {e}")
+        if verbose:
+            print(f"\n── Testing k={k} on {len(questions)} questions ──")
+        chain.k = k
+        workers = max(1, min(max_workers, len(questions)))
+        # Every sweep must reach the LLM, not answers cached by earlier runs
+        with _semantic_cache_disabled(chain), ThreadPoolExecutor(max_workers=workers) as executor:
+            scored = [s for s in executor.map(lambda q: _ablation_one(chain, q, verbose), questions)
+                      if s is not None]
+
+        answered += len(scored)
+        latencies = [lat for lat, _, _, _ in scored]
+        grounded = sum(1 for _, g, _, _ in scored if g)
+        cited = sum(1 for _, _, c, _ in scored if c)
+        partial_scores = [p for _, _, _, p in scored]
 
         n = len(questions)
+        p50, p95 = np.percentile(latencies, [50, 95]) if latencies else (0, 0)
         ablation_results[f"k={k}"] = {
             "groundedness_pct": round(grounded / n * 100, 1),
             "citation_accuracy_pct": round(cited / n * 100, 1),
             "partial_match_avg_pct": round(np.mean(partial_scores) * 100, 1) if partial_scores else 0,
-            "latency_p50_ms": round(np.percentile(latencies, 50), 1) if latencies else 0,
-            "latency_p95_ms": round(np.percentile(latencies, 95), 1) if latencies else 0,
+            "latency_p50_ms": round(p50, 1),
+            "latency_p95_ms": round(p95, 1),
         }
 
-    print("\n── Ablation Summary: k values ──")
-    print(f"{'k':>5s} | {'Ground%':>8s} | {'Cite%':>8s} | {'Match%':>8s} | {'P50ms':>8s} | {'P95ms':>8s}")
-    print("-" * 55)
+    chain.k = original_k
+
+    lines: List[str] = []
+    lines.append("\n── Ablation Summary: k values ──")
+    lines.append(f"{'k':>5s} | {'Ground%':>8s} | {'Cite%':>8s} | {'Match%':>8s} | {'P50ms':>8s} | {'P95ms':>8s}")
+    lines.append("-" * 55)
     for label, m in ablation_results.items():
-        print(f"{label:>5s} | {m['groundedness_pct']:>7.1f}% | {m['citation_accuracy_pct']:>7.1f}% | {m['partial_match_avg_pct']:>7.1f}% | {m['latency_p50_ms']:>7.0f} | {m['latency_p95_ms']:>7.0f}")
+        lines.append(f"{label:>5s} | {m['groundedness_pct']:>7.1f}% | {m['citation_accuracy_pct']:>7.1f}% | {m['partial_match_avg_pct']:>7.1f}% | {m['latency_p50_ms']:>7.0f} | {m['latency_p95_ms']:>7.0f}")
+
+    # Measured: any query that missed the batch would go through embed_query
+    cache_after = embedder.query_cache_info()
+    hits = cache_after['hits'] - cache_before['hits']
+    misses = cache_after['misses'] - cache_before['misses']
+    lines.append(f"\nQuery embeddings: {len(questions)} batch-embedded up front ({embed_ms:.1f}ms/query); "
+                 f"{answered} sweep queries made {hits + misses} embed_query calls "
+                 f"({misses} computed, {hits} LRU hits)")
+    sys.stdout.write("\n".join(lines) + "\n")
 
     return ablation_results
 
 
+# ────────────────────────────────────────────────────────────
+# Topic threshold calibration
+# ────────────────────────────────────────────────────────────
+def run_topic_calibration() -> Dict[str, Any]:
+    """
+    Measure each labelled question's cosine similarity to the corpus centroid.
+
+    The pre-retrieval topicality check refuses questions below
+    TOPIC_SIMILARITY_THRESHOLD, so the threshold belongs in the gap between
+    the most corpus-like off-topic question and the least corpus-like
+    on-topic one; the midpoint of that gap is suggested.
+    """
+    from app.rag.chain import get_rag_chain
+
+    print("\n" + "=" * 70)
+    print("  CALIBRATION: Topic similarity threshold")
+    print("=" * 70)
+
+    chain = get_rag_chain()
+    centroid = chain.vectorstore.centroid
+    if centroid is None:
+        print("\nVector store is empty; nothing to calibrate against")
+        return {}
+
+    questions = load_questions()
+    _embed_questions(chain, questions)
+    sims = np.array([float(np.dot(q['_embedding'], centroid)) for q in questions])
+    off_mask = np.array([q['expected_answer'] == "OFF_TOPIC" for q in questions])
+    on_sims, off_sims = sims[~off_mask], sims[off_mask]
+    if not (len(on_sims) and len(off_sims)):
+        print("\nNeed both on-topic and off-topic questions to calibrate")
+        return {}
+
+    lowest_on, highest_off = on_sims.min(), off_sims.max()
+    suggested = (lowest_on + highest_off) / 2 if highest_off < lowest_on else None
+    threshold = chain.topic_threshold
+
+    lines: List[str] = []
+    for label, values in (("On-topic", on_sims), ("Off-topic", off_sims)):
+        lo, med, hi = np.percentile(values, [0, 50, 100])
+        lines.append(f"\n{label:9s} ({len(values):2d}): min {lo:.3f}  median {med:.3f}  max {hi:.3f}")
+    lines.append(f"\nCurrent threshold {threshold:.3f}: refuses {int((off_sims < threshold).sum())}/{len(off_sims)} "
+                 f"off-topic and {int((on_sims < threshold).sum())}/{len(on_sims)} on-topic questions")
+    if suggested is not None:
+        lines.append(f"Suggested threshold: {suggested:.3f} (gap {highest_off:.3f} – {lowest_on:.3f})")
+    else:
+        lines.append("Classes overlap; keep the threshold below the lowest on-topic similarity")
+    sys.stdout.write("\n".join(lines) + "\n")
+
+    return {
+        "threshold": round(threshold, 3),
+        "on_topic_min": round(float(lowest_on), 3),
+        "off_topic_max": round(float(highest_off), 3),
+        "suggested_threshold": round(float(suggested), 3) if suggested is not None else None,
+        "per_question": {q['id']: round(float(s), 3) for q, s in zip(questions, sims)},
+    }
+
+
 # ────────────────────────────────────────────────────────────
 # Save
 # ────────────────────────────────────────────────────────────
@@ -391,8 +615,10 @@ def save_results(results: Dict[str, Any], filepath: str = None):
     """Save evaluation results to JSON file."""
     if filepath is None:
         filepath = Path(__file__).parent / "results.json"
-    with open(filepath, 'w') as f:
-        json.dump(results, f, indent=2, default=str)
+    # orjson encodes in C and handles numpy scalars natively, so no default=str
+    with open(filepath, 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+                             | orjson.OPT_NON_STR_KEYS))
     print(f"\n💾 Results saved to: {filepath}")
 
 
@@ -406,13 +632,20 @@ if __name__ == "__main__":
     parser.add_argument("--quiet", "-q", action="store_true", help="Minimize output")
     parser.add_argument("--save", "-s", action="store_true", help="Save results to JSON")
     parser.add_argument("--ablation", "-a", action="store_true", help="Run ablation study on k values")
+    parser.add_argument("--calibrate-topic", "-c", action="store_true",
+                        help="Measure question similarity to the corpus centroid for TOPIC_SIMILARITY_THRESHOLD")
+    parser.add_argument("--workers", "-w", type=int, default=MAX_WORKERS,
+                        help="Questions evaluated concurrently (lower it if the LLM API rate-limits)")
     args = parser.parse_args()
 
-    results = run_evaluation(verbose=not args.quiet)
+    results = run_evaluation(verbose=not args.quiet, max_workers=args.workers)
 
     if args.ablation:
-        ablation = run_ablation_k(verbose=not args.quiet)
+        ablation = run_ablation_k(verbose=not args.quiet, max_workers=args.workers)
         results["ablation_k"] = ablation
 
+    if args.calibrate_topic:
+        results["topic_calibration"] = run_topic_calibration()
+
     if args.save:
         save_results(results)